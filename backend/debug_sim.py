@@ -6,7 +6,7 @@ def run_debug():
     e.step()
     print('last history step:')
     print(json.dumps(e.history[-1], indent=2))
-    print('sum_last_consumption =', sum(getattr(a, 'last_consumption', 0) for a in e.agents))
+    print('sum_last_consumption =', float(e.agents.last_consumption.sum()))
     print('neighborhood_demands =')
     for i, v in e.env.neighborhoods.items():
         print(i, v)
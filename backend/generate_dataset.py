@@ -1,138 +1,141 @@
 import argparse
-import json
+import multiprocessing
 import random
 import csv
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Optional
+
+import numpy as np
+import orjson
 
 from simulation.simulation_engine import SimulationEngine
 from simulation.policy_definitions import HousingRentSubsidy, LuxuryAssetTax, FoodPriceCeiling, FuelTaxWithRebate
 
 
 OUT_DIR = Path(__file__).parent
-JSON_OUT = OUT_DIR / "dataset_simulated.json"
+JSON_OUT = OUT_DIR / "dataset_simulated.ndjson"
 CSV_OUT = OUT_DIR / "dataset_simulated_flat.csv"
 LABELED_CSV_OUT = OUT_DIR / "dataset_simulated_flat_labeled.csv"
 
+FLAT_FIELDS = ['seed', 'population_size', 'policy_type', 'step', 'avg_price', 'total_demand', 'gini', 'compliance_rate', 'avg_stress']
+LABELED_FIELDS = ['seed', 'population_size', 'policy_type', 'price_spike', 'supply_shortage', 'compliance_collapse']
+
 
 def detect_labels(history: List[Dict[str, Any]], neighborhoods: Dict[str, Any]) -> Dict[str, int]:
     # Price spike: any month-over-month jump > 20%
-    price_vals = [s.get('avg_price', 0) for s in history]
-    price_spike = 0
-    for i in range(1, len(price_vals)):
-        prev = price_vals[i - 1] or 1e-6
-        if price_vals[i] / prev - 1.0 > 0.20:
-            price_spike = 1
-            break
+    prices = np.array([s.get('avg_price', 0) for s in history], dtype=np.float64)
+    prev = prices[:-1]
+    ratios = prices[1:] / np.where(prev == 0, 1e-6, prev)
+    price_spike = int((ratios - 1.0 > 0.20).any())
 
     # Supply shortage: any neighborhood supply below 0.2 at final snapshot
-    supply_shortage = 0
     try:
-        for loc, data in neighborhoods.items():
-            if data.get('supply', 1.0) < 0.2:
-                supply_shortage = 1
-                break
+        supply_shortage = int(any(d.get('supply', 1.0) < 0.2 for d in neighborhoods.values()))
     except Exception:
         supply_shortage = 0
 
-    # Compliance collapse: any step with compliance_rate < 0.5
-    comp_collapse = 0
-    for s in history:
-        if s.get('compliance_rate', 1.0) < 0.5:
-            comp_collapse = 1
-            break
+    # Compliance collapse: any step with compliance_rate < 0.5 (stops at the first one)
+    comp_collapse = int(any(s.get('compliance_rate', 1.0) < 0.5 for s in history))
 
     return {'price_spike': price_spike, 'supply_shortage': supply_shortage, 'compliance_collapse': comp_collapse}
 
 
-def generate_sample(num_runs: int = 100, steps: int = 24) -> Tuple[Path, Path, Path]:
-    results: List[Dict[str, Any]] = []
-    flat_rows: List[Dict[str, Any]] = []
-    labeled_rows: List[Dict[str, Any]] = []
-
-    for s in range(num_runs):
-        seed = random.randint(0, 2**31 - 1)
-        pop = random.randint(50, 300)
-        engine = SimulationEngine(population_size=pop, seed=seed)
-
-        # Randomly pick a policy or no policy
-        policy_choice = random.choice([None, 'housing', 'luxury', 'food', 'fuel'])
-        policy_meta = None
-        if policy_choice == 'housing':
-            subsidy_amt = random.uniform(50, 500)
-            elig = random.uniform(500, 2000)
-            policy = HousingRentSubsidy(subsidy_amount=subsidy_amt, eligibility_threshold=elig)
-            policy_meta = {'type': 'housing_rent_subsidy', 'params': {'subsidy_amount': policy.get_param('subsidy_amount'), 'eligibility_threshold': policy.get_param('eligibility_threshold')}}
-            engine.add_policy(policy)
-        elif policy_choice == 'luxury':
-            policy = LuxuryAssetTax(tax_rate=random.uniform(0.0, 0.2), wealth_threshold=random.uniform(1000, 5000))
-            policy_meta = {'type': 'luxury_asset_tax', 'params': {'tax_rate': policy.get_param('tax_rate'), 'wealth_threshold': policy.get_param('wealth_threshold')}}
-            engine.add_policy(policy)
-        elif policy_choice == 'food':
-            cap = random.uniform(1.0, 10.0)
-            policy = FoodPriceCeiling(price_cap=cap)
-            policy_meta = {'type': 'food_price_ceiling', 'params': {'price_cap': policy.get_param('price_cap')}}
-            engine.add_policy(policy)
-        elif policy_choice == 'fuel':
-            tax = random.uniform(0.0, 0.5)
-            rebate = random.uniform(0.5, 1.0)
-            policy = FuelTaxWithRebate(tax_rate=tax, rebate_percent=rebate)
-            policy_meta = {'type': 'fuel_tax_rebate', 'params': {'tax_rate': policy.get_param('tax_rate'), 'rebate_percent': policy.get_param('rebate_percent')}}
-            engine.add_policy(policy)
-
-        history = engine.run(steps)
-        neighborhoods = engine.env.neighborhoods
-
-        labels = detect_labels(history, neighborhoods)
-
-        run_rec = {'seed': seed, 'population_size': pop, 'policy': policy_meta, 'history': history, 'neighborhoods': neighborhoods, 'labels': labels}
-        results.append(run_rec)
-
-        # Flatten per-step metrics for CSV
-        for step in history:
-            row = {
-                'seed': seed,
-                'population_size': pop,
-                'policy_type': policy_meta['type'] if policy_meta else 'none',
-                'step': step.get('step'),
-                'avg_price': step.get('avg_price'),
-                'total_demand': step.get('total_demand'),
-                'gini': step.get('gini'),
-                'compliance_rate': step.get('compliance_rate'),
-                'avg_stress': step.get('avg_stress')
-            }
-            flat_rows.append(row)
-
-        # Add a single labeled row per run (summary)
-        labeled_rows.append({
+POLICY_CLASSES = {
+    'housing_rent_subsidy': HousingRentSubsidy,
+    'luxury_asset_tax': LuxuryAssetTax,
+    'food_price_ceiling': FoodPriceCeiling,
+    'fuel_tax_rebate': FuelTaxWithRebate,
+}
+
+
+def sample_policy_meta() -> Optional[Dict[str, Any]]:
+    """Randomly pick a policy (or no policy) and its parameters."""
+    policy_choice = random.choice([None, 'housing', 'luxury', 'food', 'fuel'])
+    if policy_choice == 'housing':
+        subsidy_amt = random.uniform(50, 500)
+        elig = random.uniform(500, 2000)
+        return {'type': 'housing_rent_subsidy', 'params': {'subsidy_amount': subsidy_amt, 'eligibility_threshold': elig}}
+    if policy_choice == 'luxury':
+        return {'type': 'luxury_asset_tax', 'params': {'tax_rate': random.uniform(0.0, 0.2), 'wealth_threshold': random.uniform(1000, 5000)}}
+    if policy_choice == 'food':
+        cap = random.uniform(1.0, 10.0)
+        return {'type': 'food_price_ceiling', 'params': {'price_cap': cap}}
+    if policy_choice == 'fuel':
+        tax = random.uniform(0.0, 0.5)
+        rebate = random.uniform(0.5, 1.0)
+        return {'type': 'fuel_tax_rebate', 'params': {'tax_rate': tax, 'rebate_percent': rebate}}
+    return None
+
+
+def _run_one(args: Tuple[int, int, Optional[Dict[str, Any]], int]) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]:
+    """Runs a single simulation; module-level so it can be shipped to worker processes."""
+    seed, pop, policy_meta, steps = args
+    engine = SimulationEngine(population_size=pop, seed=seed)
+    if policy_meta:
+        engine.add_policy(POLICY_CLASSES[policy_meta['type']](**policy_meta['params']))
+
+    history = engine.run(steps)
+    neighborhoods = engine.env.neighborhoods
+
+    labels = detect_labels(history, neighborhoods)
+
+    run_rec = {'seed': seed, 'population_size': pop, 'policy': policy_meta, 'history': history, 'neighborhoods': neighborhoods, 'labels': labels}
+
+    # Flatten per-step metrics for CSV
+    flat_rows = []
+    for step in history:
+        row = {
             'seed': seed,
             'population_size': pop,
             'policy_type': policy_meta['type'] if policy_meta else 'none',
-            'price_spike': labels['price_spike'],
-            'supply_shortage': labels['supply_shortage'],
-            'compliance_collapse': labels['compliance_collapse']
-        })
-
-    # Write JSON
-    with open(JSON_OUT, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2)
-
-    # Write CSV
-    if flat_rows:
-        with open(CSV_OUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=list(flat_rows[0].keys()))
-            writer.writeheader()
-            for r in flat_rows:
-                writer.writerow(r)
-
-    # Write labeled summary CSV (one row per run)
-    if labeled_rows:
-        keys = list(labeled_rows[0].keys())
-        with open(LABELED_CSV_OUT, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=keys)
-            writer.writeheader()
-            for r in labeled_rows:
-                writer.writerow(r)
+            'step': step.get('step'),
+            'avg_price': step.get('avg_price'),
+            'total_demand': step.get('total_demand'),
+            'gini': step.get('gini'),
+            'compliance_rate': step.get('compliance_rate'),
+            'avg_stress': step.get('avg_stress')
+        }
+        flat_rows.append(row)
+
+    # Add a single labeled row per run (summary)
+    labeled_row = {
+        'seed': seed,
+        'population_size': pop,
+        'policy_type': policy_meta['type'] if policy_meta else 'none',
+        'price_spike': labels['price_spike'],
+        'supply_shortage': labels['supply_shortage'],
+        'compliance_collapse': labels['compliance_collapse']
+    }
+    return run_rec, flat_rows, labeled_row
+
+
+def generate_sample(num_runs: int = 100, steps: int = 24, max_workers: Optional[int] = None) -> Tuple[Path, Path, Path]:
+    # Draw every run's configuration up front; the runs themselves are independent
+    run_args = []
+    for s in range(num_runs):
+        seed = random.randint(0, 2**31 - 1)
+        pop = random.randint(50, 300)
+        run_args.append((seed, pop, sample_policy_meta(), steps))
+
+    # Stream each run to disk as soon as it completes instead of holding the whole dataset in memory.
+    # Workers are spawned: forking once Numba's thread pool is running can hang the process at exit
+    with open(JSON_OUT, 'wb') as json_f, \
+            open(CSV_OUT, 'w', newline='', encoding='utf-8') as csv_f, \
+            open(LABELED_CSV_OUT, 'w', newline='', encoding='utf-8') as labeled_f, \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+        # Flattened per-step metrics (one row per step)
+        writer = csv.DictWriter(csv_f, fieldnames=FLAT_FIELDS)
+        writer.writeheader()
+        # Labeled summary (one row per run)
+        labeled_writer = csv.DictWriter(labeled_f, fieldnames=LABELED_FIELDS)
+        labeled_writer.writeheader()
+
+        for run_rec, flat_rows, labeled_row in ex.map(_run_one, run_args, chunksize=4):
+            # One JSON record per line (NDJSON)
+            json_f.write(orjson.dumps(run_rec, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) + b'\n')
+            writer.writerows(flat_rows)
+            labeled_writer.writerow(labeled_row)
 
     return JSON_OUT, CSV_OUT, LABELED_CSV_OUT
 
@@ -141,13 +144,14 @@ def parse_args():
     p = argparse.ArgumentParser(description='Generate simulated dataset from poliSEE simulator')
     p.add_argument('--runs', type=int, default=100, help='Number of simulation runs')
     p.add_argument('--steps', type=int, default=24, help='Number of steps per run')
+    p.add_argument('--workers', type=int, default=None, help='Worker processes (defaults to the CPU count)')
     return p.parse_args()
 
 
 if __name__ == '__main__':
     args = parse_args()
     print(f'Generating sample dataset: runs={args.runs}, steps={args.steps} ...')
-    json_path, csv_path, labeled_csv = generate_sample(num_runs=args.runs, steps=args.steps)
+    json_path, csv_path, labeled_csv = generate_sample(num_runs=args.runs, steps=args.steps, max_workers=args.workers)
     print('Wrote JSON:', json_path)
     print('Wrote CSV:', csv_path)
     print('Wrote Labeled summary CSV:', labeled_csv)
@@ -1,14 +1,21 @@
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 
-from simulation.simulation_engine import SimulationEngine
+from simulation.simulation_engine import SimulationEngine, warm_up_engine
 from simulation.policy_definitions import HousingRentSubsidy, LuxuryAssetTax, FoodPriceCeiling, FuelTaxWithRebate
 from simulation.emergence_detector import EmergenceDetector
 from simulation.counterfactual_analysis import CounterfactualAnalyzer
 
-app = FastAPI(title="poliSEE API", description="Public Policy Side-Effect Simulator")
+class ORJSONResponse(JSONResponse):
+    """Serializes responses with orjson, including NumPy scalars and int dict keys."""
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+app = FastAPI(title="poliSEE API", description="Public Policy Side-Effect Simulator", default_response_class=ORJSONResponse)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -18,6 +25,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compile the Numba kernels on the main thread before any request handler runs them
+# from the threadpool; the parallel backend must be initialised outside worker threads.
+warm_up_engine()
+
 class SimulationRequest(BaseModel):
     policy_type: str
     params: Dict[str, float]
@@ -28,8 +39,58 @@ class SimulationRequest(BaseModel):
 async def root():
     return {"message": "poliSEE Backend is running"}
 
+# Build a richer plain-language explanation and recommendations
+def build_explanation(analysis: Dict[str, Any], history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    msgs: List[str] = []
+    recs: List[str] = []
+
+    metrics = analysis.get("metrics", {})
+    price_accel = metrics.get("price_acceleration", 0)
+    vol = metrics.get("volatility", 0)
+    comp_instab = metrics.get("compliance_instability", 0)
+
+    latest = history[-1] if history else {}
+    latest_price = latest.get("avg_price")
+    latest_compliance = latest.get("compliance_rate")
+
+    if price_accel > 0.5:
+        msgs.append(f"Rapid price acceleration detected (score={price_accel}). Prices may spiral if unchecked.")
+        recs.append("Reduce subsidy magnitude or increase housing supply interventions to cool price pressures.")
+    elif vol > 0.3:
+        msgs.append(f"Elevated price volatility observed (volatility={vol}). Market instability may be emerging.")
+        recs.append("Consider phased implementation and monitoring to avoid sudden shocks.")
+    else:
+        msgs.append("Price behavior appears within expected bounds for this scenario.")
+
+    if comp_instab > 0.1:
+        msgs.append("Compliance instability detected — watch for shadow-market behaviors.")
+        recs.append("Increase enforcement visibility and reduce incentives for evasion.")
+    else:
+        msgs.append("Compliance levels are stable in recent steps.")
+
+    # Stress vs inequality
+    # Use a simple trend check: if UCI flagged stress decoupling earlier, mention it
+    if any(a.get("type") == "Stress Decoupling" for a in analysis.get("alerts", [])):
+        msgs.append("Inequality is improving while stress rises — this can indicate supply shortages affecting well-being.")
+        recs.append("Target supply-side measures or temporary price supports for essentials.")
+
+    # Summary line with latest metrics
+    summary_parts = []
+    if latest_price is not None:
+        summary_parts.append(f"Latest avg price: {latest_price:.2f}.")
+    if latest_compliance is not None:
+        summary_parts.append(f"Latest compliance: {int(round(latest_compliance * 100))}%.")
+
+    explanation_text = " ".join(msgs + summary_parts)
+    return {"text": explanation_text, "recommendations": recs}
+
+# Holds only its window size, so one instance can serve every request
+detector = EmergenceDetector()
+
+# CPU-bound handlers are plain `def` so Starlette runs them in its threadpool
+# instead of blocking the event loop for the length of a simulation.
 @app.post("/simulate")
-async def run_simulation(request: SimulationRequest):
+def run_simulation(request: SimulationRequest):
     try:
         engine = SimulationEngine(population_size=request.population_size)
         
@@ -61,71 +122,26 @@ async def run_simulation(request: SimulationRequest):
         history = engine.run(request.steps)
         
         # Detect unintended consequences
-        detector = EmergenceDetector()
         analysis = detector.analyze(history)
 
         # Provide neighborhood snapshots for debugging/visualization
         neighborhoods = engine.env.neighborhoods
 
-        # Build a richer plain-language explanation and recommendations
-        def build_explanation(analysis: Dict[str, Any], history: List[Dict[str, Any]]) -> Dict[str, Any]:
-            msgs: List[str] = []
-            recs: List[str] = []
-
-            metrics = analysis.get("metrics", {})
-            price_accel = metrics.get("price_acceleration", 0)
-            vol = metrics.get("volatility", 0)
-            comp_instab = metrics.get("compliance_instability", 0)
-
-            latest = history[-1] if history else {}
-            latest_price = latest.get("avg_price")
-            latest_compliance = latest.get("compliance_rate")
-
-            if price_accel > 0.5:
-                msgs.append(f"Rapid price acceleration detected (score={price_accel}). Prices may spiral if unchecked.")
-                recs.append("Reduce subsidy magnitude or increase housing supply interventions to cool price pressures.")
-            elif vol > 0.3:
-                msgs.append(f"Elevated price volatility observed (volatility={vol}). Market instability may be emerging.")
-                recs.append("Consider phased implementation and monitoring to avoid sudden shocks.")
-            else:
-                msgs.append("Price behavior appears within expected bounds for this scenario.")
-
-            if comp_instab > 0.1:
-                msgs.append("Compliance instability detected — watch for shadow-market behaviors.")
-                recs.append("Increase enforcement visibility and reduce incentives for evasion.")
-            else:
-                msgs.append("Compliance levels are stable in recent steps.")
-
-            # Stress vs inequality
-            # Use a simple trend check: if UCI flagged stress decoupling earlier, mention it
-            if any(a.get("type") == "Stress Decoupling" for a in analysis.get("alerts", [])):
-                msgs.append("Inequality is improving while stress rises — this can indicate supply shortages affecting well-being.")
-                recs.append("Target supply-side measures or temporary price supports for essentials.")
-
-            # Summary line with latest metrics
-            summary_parts = []
-            if latest_price is not None:
-                summary_parts.append(f"Latest avg price: {latest_price:.2f}.")
-            if latest_compliance is not None:
-                summary_parts.append(f"Latest compliance: {int(round(latest_compliance * 100))}%.")
-
-            explanation_text = " ".join(msgs + summary_parts)
-            return {"text": explanation_text, "recommendations": recs}
-
         explain = build_explanation(analysis, history)
 
-        return {
+        # Returned directly so the payload skips jsonable_encoder and goes straight to orjson
+        return ORJSONResponse({
             "history": history,
             "analysis": analysis,
             "neighborhoods": neighborhoods,
             "explanation": explain.get("text", ""),
             "recommendations": explain.get("recommendations", []),
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/compare")
-async def compare_policies(request: List[SimulationRequest]):
+def compare_policies(request: List[SimulationRequest]):
     # Simplified multi-policy comparison
     analyzer = CounterfactualAnalyzer(population_size=100)
     policies = []
@@ -136,7 +152,7 @@ async def compare_policies(request: List[SimulationRequest]):
         # Add others...
         
     results = analyzer.compare_policies(policies)
-    return results
+    return ORJSONResponse(results)
 
 if __name__ == "__main__":
     import uvicorn
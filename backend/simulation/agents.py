@@ -1,117 +1,217 @@
-import random
+import math
 import numpy as np
-from typing import List, Optional
+from dataclasses import dataclass
+from numba import njit, prange
+from typing import Iterator, Optional
+from .policy_definitions import capital_flight_probability, wealth_tax
+
+# Decision codes stored (as int8) in AgentArray.last_decision_code
+COMPLY_CODE = 0
+EVADE_CODE = 1
+
+@njit(cache=True, parallel=True, fastmath=True)
+def _step_kernel(
+    wealth, need, risk_tolerance, compliance_probability, stress, last_consumption, decision_code,
+    price, availability, wealth_tax_rate, wealth_threshold, expected_penalty,
+    need_noise, flight_draws, compliance_draws
+):
+    """
+    Compiled per-agent body of SimulationEngine.step: consumption, stress,
+    luxury tax with capital flight, and the compliance decision.
+    Mutates the agent arrays in place and returns
+    (wealth tax collected, number of evaders, summed stress).
+    A wealth_tax_rate of 0 means no luxury tax is active.
+    The float totals are summed serially after the parallel pass, so they
+    don't depend on how many threads ran it.
+    """
+    n = wealth.shape[0]
+    penalty = max(0.1, expected_penalty)
+    tax_paid = np.zeros(n) if wealth_tax_rate > 0.0 else np.zeros(0)
+    evaded = 0
+    for i in prange(n):
+        # Simplistic budget constraint with a 'buffer' for irrationality
+        affordable_qty = wealth[i] / max(0.1, price[i])
+        target_qty = need[i] * (1.1 - 0.2 * need_noise[i]) # Stochastic need
+
+        actual_qty = min(target_qty, affordable_qty, availability[i])
+        wealth[i] -= actual_qty * price[i]
+        last_consumption[i] = actual_qty
+
+        # Stress rises with the size of the unmet gap, and decays more slowly when needs are met
+        threshold = need[i] * 0.8
+        if actual_qty < threshold:
+            level = stress[i] + 0.05 + ((threshold - actual_qty) / threshold) * 0.15
+        else:
+            level = stress[i] - 0.03
+        stress[i] = max(0.0, min(1.0, level))
+
+        # Luxury tax and capital flight (LuxuryAssetTax)
+        if wealth_tax_rate > 0.0:
+            tax = wealth_tax(wealth[i], wealth_threshold, wealth_tax_rate)
+            wealth[i] -= tax
+            tax_paid[i] = tax
+            if flight_draws[i] < capital_flight_probability(wealth[i], wealth_threshold, wealth_tax_rate):
+                # Agent "hides" or moves 50% of wealth out of the system
+                wealth[i] *= 0.5
+                stress[i] = min(1.0, stress[i] + 0.2)
+
+        # Compliance: stress lowers the threshold for evasion
+        effective_risk_tolerance = risk_tolerance[i] * (1.0 + stress[i])
+        incentive = price[i] * 0.6 / penalty
+        evasion_prob = 1.0 / (1.0 + math.exp(-(2.0 * incentive + 5.0 * (effective_risk_tolerance - 0.7))))
+        if compliance_draws[i] < evasion_prob * (1.0 - compliance_probability[i]):
+            decision_code[i] = EVADE_CODE
+            evaded += 1
+        else:
+            decision_code[i] = COMPLY_CODE
+
+    total_wealth_tax = 0.0
+    for i in range(tax_paid.shape[0]):
+        total_wealth_tax += tax_paid[i]
+    total_stress = 0.0
+    for i in range(n):
+        total_stress += stress[i]
+    return total_wealth_tax, evaded, total_stress
+
+
+@njit(cache=True, parallel=True)
+def _social_influence_kernel(decisions, compliance_probability, weight, indptr, indices):
+    """
+    Compiled Agent.apply_social_influence over a CSR social graph.
+    Mutates compliance_probability in place.
+    """
+    for i in prange(compliance_probability.shape[0]):
+        start = indptr[i]
+        end = indptr[i + 1]
+        if start == end:
+            continue
+        evaded = 0
+        for j in range(start, end):
+            evaded += decisions[indices[j]]
+        evasion_rate = evaded / (end - start)
+
+        # Drift compliance probability based on social pressure
+        adjustment = (evasion_rate - 0.5) * weight[i]
+        compliance_probability[i] = max(0.1, min(1.0, compliance_probability[i] - adjustment))
+
+
+@dataclass(eq=False)
+class AgentArray:
+    """
+    Structure-of-Arrays container for a heterogeneous population.
+    Each field holds one value per agent; row i is agent i.
+    """
+    income: np.ndarray
+    base_income: np.ndarray
+    consumption_need: np.ndarray
+    mobility: np.ndarray
+    risk_tolerance: np.ndarray
+    social_influence_weight: np.ndarray
+
+    # State variables
+    wealth: np.ndarray
+    compliance_probability: np.ndarray
+    is_eligible: np.ndarray
+    last_decision_code: np.ndarray
+    stress_level: np.ndarray
+    last_consumption: np.ndarray
+
+    @classmethod
+    def from_traits(
+        cls,
+        income: np.ndarray,
+        consumption_need: np.ndarray,
+        mobility: np.ndarray,
+        risk_tolerance: np.ndarray,
+        social_influence_weight: float = 0.1
+    ) -> "AgentArray":
+        """Builds a population with the same initial state the scalar Agent used."""
+        income = np.asarray(income, dtype=np.float64)
+        n = len(income)
+        risk_tolerance = np.asarray(risk_tolerance, dtype=np.float64)
+        consumption_need = np.asarray(consumption_need, dtype=np.float64)
+        return cls(
+            income=income.copy(),
+            base_income=income.copy(),
+            consumption_need=consumption_need,
+            mobility=np.asarray(mobility, dtype=np.float64),
+            risk_tolerance=risk_tolerance,
+            social_influence_weight=np.full(n, social_influence_weight),
+            wealth=income.copy(),
+            compliance_probability=1.0 - (0.5 * (1.0 - risk_tolerance)), # Higher risk tolerance -> lower compliance
+            is_eligible=np.zeros(n, dtype=bool),
+            last_decision_code=np.full(n, COMPLY_CODE, dtype=np.int8),
+            stress_level=np.zeros(n),
+            last_consumption=consumption_need.copy(), # Until the first step, demand is the static need
+        )
+
+    def __len__(self) -> int:
+        return len(self.income)
+
+    def __getitem__(self, agent_id: int) -> "Agent":
+        return Agent(self, agent_id)
+
+    def __iter__(self) -> Iterator["Agent"]:
+        for i in range(len(self)):
+            yield Agent(self, i)
+
 
 class Agent:
     """
     A heterogeneous agent representing a consumer/citizen.
     Features: Bounded rationality, social influence, and stochastic behavior.
+
+    Agents are thin views onto one row of an AgentArray; reads and writes
+    go straight through to the underlying arrays.
     """
-    def __init__(
-        self, 
-        agent_id: int, 
-        income: float, 
-        consumption_need: float, 
-        mobility: float, 
-        risk_tolerance: float,
-        social_influence_weight: float = 0.1,
-        seed: Optional[int] = None
-    ):
+    __slots__ = ("population", "id")
+
+    COMPLY = COMPLY_CODE
+    EVADE = EVADE_CODE
+
+    def __init__(self, population: AgentArray, agent_id: int):
+        self.population = population
         self.id = agent_id
-        self.income = income
-        self.base_income = income
-        self.consumption_need = consumption_need
-        self.mobility = mobility
-        self.risk_tolerance = risk_tolerance
-        self.social_influence_weight = social_influence_weight
-        
-        # State variables
-        self.wealth = income
-        self.compliance_probability = 1.0 - (0.5 * (1.0 - risk_tolerance)) # Higher risk tolerance -> lower compliance
-        self.is_eligible = False
-        self.last_decision = "comply"
-        self.stress_level = 0.0
-        self.last_consumption = 0.0
-        
-        if seed is not None:
-            random.seed(seed)
-            np.random.seed(seed)
 
-    def decide_consumption(self, price: float, availability: float) -> float:
-        """
-        Bounded rationality: Agents don't optimize perfectly.
-        They try to meet their consumption_need but are constrained by wealth and price.
-        """
-        # Simplistic budget constraint with a 'buffer' for irrationality
-        affordable_qty = self.wealth / max(0.1, price)
-        target_qty = self.consumption_need * (1.1 - 0.2 * random.random()) # Stochastic need
-        
-        actual_qty = min(target_qty, affordable_qty, availability)
-        self.wealth -= actual_qty * price
-        self.last_consumption = actual_qty
-        
-        # Stress increases if need isn't met, decreases if satisfied
-        if actual_qty < self.consumption_need * 0.8:
-            # Stress increases faster if the gap is larger
-            gap = (self.consumption_need * 0.8 - actual_qty) / (self.consumption_need * 0.8)
-            self.stress_level += 0.05 + (gap * 0.15)
-        else:
-            # Stress decreases if needs are met, but slower than it increases
-            self.stress_level -= 0.03
-            
-        self.stress_level = max(0.0, min(1.0, self.stress_level))
-        return actual_qty
+    def _field(name: str):
+        def fget(self):
+            return getattr(self.population, name)[self.id]
 
-    def decide_compliance(self, expected_penalty: float, black_market_premium: float) -> str:
-        """
-        Decision rule for compliance or evasion (e.g., black market).
-        Factors: Risk tolerance, peer influence, and economic incentive.
-        """
-        # Agents with high stress are more desperate and likely to evade
-        effective_risk_tolerance = self.risk_tolerance * (1.0 + self.stress_level)
-        
-        # Economic incentive: benefit vs cost
-        # If benefit is high relative to penalty, evasion is more likely
-        incentive = black_market_premium / max(0.1, expected_penalty)
-        
-        # Probabilistic decision: higher incentive and higher risk tolerance -> higher evasion prob
-        # We use a sigmoid-like function for the probability
-        evasion_prob = 1.0 / (1.0 + np.exp(-(2.0 * incentive + 5.0 * (effective_risk_tolerance - 0.7))))
-        
-        # Factor in the agent's inherent compliance probability (socialized trait)
-        final_evasion_prob = evasion_prob * (1.0 - self.compliance_probability)
-        
-        if random.random() < final_evasion_prob:
-            self.last_decision = "evade"
-            return "evade"
-        
-        self.last_decision = "comply"
-        return "comply"
+        def fset(self, value):
+            getattr(self.population, name)[self.id] = value
+        return property(fget, fset)
+
+    income = _field("income")
+    base_income = _field("base_income")
+    consumption_need = _field("consumption_need")
+    mobility = _field("mobility")
+    risk_tolerance = _field("risk_tolerance")
+    social_influence_weight = _field("social_influence_weight")
+    wealth = _field("wealth")
+    compliance_probability = _field("compliance_probability")
+    is_eligible = _field("is_eligible")
+    last_decision_code = _field("last_decision_code")
+    stress_level = _field("stress_level")
+    last_consumption = _field("last_consumption")
+    last_decision = last_decision_code # Agent.COMPLY or Agent.EVADE
+    del _field
 
-    def apply_social_influence(self, neighbors_behavior: List[str]):
+    def apply_social_influence(self, neighbors_behavior: np.ndarray):
         """
         Peer influence: Agents partially imitate neighbors.
         If many neighbors evade, compliance probability drops.
+        `neighbors_behavior` holds the neighbors' last decision codes
+        (see Environment.get_neighbors_behavior).
         """
-        if not neighbors_behavior:
+        if len(neighbors_behavior) == 0:
             return
             
-        evasion_rate = neighbors_behavior.count("evade") / len(neighbors_behavior)
+        evasion_rate = np.count_nonzero(np.asarray(neighbors_behavior) == self.EVADE) / len(neighbors_behavior)
         
         # Drift compliance probability based on social pressure
         adjustment = (evasion_rate - 0.5) * self.social_influence_weight
         self.compliance_probability = max(0.1, min(1.0, self.compliance_probability - adjustment))
 
-    def relocate(self, local_utility: float, global_avg_utility: float) -> bool:
-        """Decision to move based on mobility and local vs global conditions."""
-        if self.mobility < 0.2: return False # Stuck
-        
-        relocation_incentive = global_avg_utility - local_utility
-        if relocation_incentive > (1.0 - self.mobility):
-            if random.random() < self.mobility:
-                return True
-        return False
-
     def update_income(self, new_income: float):
         """Update monthly income and replenish wealth for the new month."""
         self.income = new_income
@@ -122,25 +222,20 @@ class Agent:
     def __repr__(self):
         return f"Agent(id={self.id}, income={self.income:.1f}, stress={self.stress_level:.2f})"
 
-def generate_population(n: int, seed: int = 42) -> List[Agent]:
-    """Generates a heterogeneous population across income deciles."""
-    random.seed(seed)
-    np.random.seed(seed)
-    
-    population = []
-    for i in range(n):
-        # Pareto-like income distribution
-        income = np.random.lognormal(mean=7.0, sigma=0.8) 
-        consumption_need = 500 + (income * 0.2) # Basic need + discretionary
-        mobility = random.uniform(0, 1)
-        risk_tolerance = random.uniform(0, 1)
-        
-        agent = Agent(
-            agent_id=i,
-            income=income,
-            consumption_need=consumption_need,
-            mobility=mobility,
-            risk_tolerance=risk_tolerance
-        )
-        population.append(agent)
-    return population
+def generate_population(n: int, seed: int = 42, rng: Optional[np.random.Generator] = None) -> AgentArray:
+    """
+    Generates a heterogeneous population across income deciles.
+    Traits are drawn from `rng` when given, else from a Generator seeded with `seed`;
+    the global random / np.random state is left alone.
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+
+    # One batched draw per trait rather than one call per agent
+    incomes = rng.lognormal(mean=7.0, sigma=0.8, size=n) # Pareto-like income distribution
+    return AgentArray.from_traits(
+        income=incomes,
+        consumption_need=500 + (incomes * 0.2), # Basic need + discretionary
+        mobility=rng.random(n),
+        risk_tolerance=rng.random(n)
+    )
@@ -1,41 +1,110 @@
-from typing import List, Dict, Any
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
 from .simulation_engine import SimulationEngine
 from .policy_definitions import Policy
-import copy
+
+# (result key, history key) pairs for the end-of-run metrics
+FINAL_METRICS = (
+    ("final_compliance", "compliance_rate"),
+    ("final_inequality", "gini"),
+    ("final_price", "avg_price"),
+    ("final_stress", "avg_stress"),
+)
+
+# Below this many agent-steps across all variants, starting worker processes costs more
+# than running the variants in turn (a 100-agent, 24-step variant takes a few ms)
+PARALLEL_MIN_AGENT_STEPS = 5_000_000
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers: Optional[int] = None
+_pool_lock = threading.Lock()
+
+def _shared_pool(max_workers: Optional[int]) -> ProcessPoolExecutor:
+    """One worker pool per process, created on first use and reused by every analyzer."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # Spawn rather than fork: callers such as the API run this from worker threads,
+            # and forking a threaded process can leave Numba's thread pool in a bad state
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = max_workers
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drops a broken pool so the next parallel call starts a fresh one."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is pool:
+            _pool, _pool_workers = None, None
+    pool.shutdown(wait=False)
+
+def _run_policy(population_size: int, seed: int, policy: Policy, steps: int, include_history: bool = True) -> Dict[str, Any]:
+    """Runs one policy variant; module-level so it can execute in a worker process."""
+    # Create a fresh engine with the same seed
+    engine = SimulationEngine(population_size=population_size, seed=seed)
+    engine.add_policy(policy)
+
+    history = engine.run(steps)
+
+    # Key metrics for comparison
+    final_state = history[-1]
+    result = {key: final_state[field] for key, field in FINAL_METRICS}
+    result["policy_params"] = {k: v.value for k, v in policy.parameters.items()}
+    if include_history:
+        result["history"] = history
+    return result
 
 class CounterfactualAnalyzer:
     """
     Runs the same population under multiple policy variants.
     Holds agent randomness constant for fair comparison.
     """
-    def __init__(self, population_size: int = 100, seed: int = 42):
+    def __init__(self, population_size: int = 100, seed: int = 42, max_workers: Optional[int] = None):
         self.population_size = population_size
         self.seed = seed
+        self.max_workers = max_workers
 
-    def compare_policies(self, policies: List[Policy], steps: int = 24) -> Dict[str, Any]:
+    def compare_policies(
+        self, policies: List[Policy], steps: int = 24, include_history: bool = True, parallel: Optional[bool] = None
+    ) -> Dict[str, Any]:
         """
         Runs multiple simulations and compares outcomes.
+        Variants run in this process unless `parallel` is set, or, when it is None,
+        the job is large enough (PARALLEL_MIN_AGENT_STEPS) to pay for the shared worker pool.
+        Pass include_history=False when only the final metrics are needed
+        (e.g. for identify_dominance) to avoid building every step into the result.
         """
         results = {}
-        
+        if not policies:
+            return results
+
+        if parallel is None:
+            parallel = len(policies) > 1 and len(policies) * self.population_size * steps >= PARALLEL_MIN_AGENT_STEPS
+        if parallel:
+            pool = _shared_pool(self.max_workers)
+            try:
+                futures = [
+                    pool.submit(_run_policy, self.population_size, self.seed, policy, steps, include_history)
+                    for policy in policies
+                ]
+                # Collect in submission order so result keys stay stable
+                for i, (policy, future) in enumerate(zip(policies, futures)):
+                    results[f"policy_{i}_{policy.type.name}"] = future.result()
+                return results
+            except RuntimeError:
+                # BrokenProcessPool: workers can't start in every host (e.g. a script piped in on stdin).
+                # Plain RuntimeError: another caller shut this pool down mid-submit. Either way, run here instead
+                _discard_pool(pool)
+                results = {}
+
         for i, policy in enumerate(policies):
-            # Create a fresh engine with the same seed
-            engine = SimulationEngine(population_size=self.population_size, seed=self.seed)
-            engine.add_policy(policy)
-            
-            history = engine.run(steps)
-            
-            # Key metrics for comparison
-            final_state = history[-1]
-            results[f"policy_{i}_{policy.type.name}"] = {
-                "history": history,
-                "final_compliance": final_state["compliance_rate"],
-                "final_inequality": final_state["gini"],
-                "final_price": final_state["avg_price"],
-                "final_stress": final_state["avg_stress"],
-                "policy_params": {k: v.value for k, v in policy.parameters.items()}
-            }
-            
+            results[f"policy_{i}_{policy.type.name}"] = _run_policy(
+                self.population_size, self.seed, policy, steps, include_history
+            )
         return results
 
     def identify_dominance(self, results: Dict[str, Any]) -> str:
@@ -1,5 +1,178 @@
 import numpy as np
-from typing import List, Dict, Any
+from collections import deque
+from numpy.lib import recfunctions
+from numba import njit
+from typing import List, Dict, Any, Optional, Union
+
+# History keys analyzed by EmergenceDetector, in column order
+MACRO_COLUMNS = ("avg_price", "gini", "compliance_rate", "avg_stress")
+
+# Rows of the array returned by _window_stats_kernel
+RECENT_MEAN, PREVIOUS_MEAN, RECENT_STD, PREVIOUS_STD, SLOPE, ACCELERATION = range(6)
+
+# CUSUM reference drift and decision threshold, in standard deviations of the earlier observations.
+# Set so 24-step no-policy baselines essentially never alarm, while strong subsidy-driven price spirals do
+CUSUM_K = 1.0
+CUSUM_H = 5.0
+
+@njit(cache=True)
+def _window_stats_kernel(series, window):
+    """
+    Fused statistics for each column of a (T, K) series, with no temporaries:
+    recent/previous window mean and std, OLS slope against the step index,
+    and the normalized mean second difference over the recent window.
+    Columns that never change only get their means; the other rows stay 0.
+    Returns a (6, K) array indexed by the row constants above.
+    """
+    t, k = series.shape
+    split = t - window
+    x_mean = (t - 1) / 2.0
+    ss_x = 0.0
+    for i in range(t):
+        ss_x += (i - x_mean) * (i - x_mean)
+    first_diff2 = max(0, t - 2 - window)
+
+    out = np.zeros((6, k))
+    for c in range(k):
+        recent_sum = 0.0
+        previous_sum = 0.0
+        flat = True
+        base = series[0, c]
+        for i in range(t):
+            if i < split:
+                previous_sum += series[i, c]
+            else:
+                recent_sum += series[i, c]
+            if series[i, c] != base:
+                flat = False
+        recent_mean = recent_sum / window
+        previous_mean = previous_sum / split
+        out[RECENT_MEAN, c] = recent_mean
+        out[PREVIOUS_MEAN, c] = previous_mean
+        if flat:
+            # No spread, trend or acceleration to measure (e.g. compliance pinned at 1.0)
+            continue
+
+        recent_sq = 0.0
+        previous_sq = 0.0
+        xy = 0.0
+        for i in range(t):
+            v = series[i, c]
+            if i < split:
+                previous_sq += (v - previous_mean) * (v - previous_mean)
+            else:
+                recent_sq += (v - recent_mean) * (v - recent_mean)
+            # Offsetting by the first value leaves the slope unchanged and keeps flat series exactly at 0
+            xy += (i - x_mean) * (v - base)
+
+        diff2_sum = 0.0
+        for j in range(first_diff2, t - 2):
+            diff2_sum += series[j + 2, c] - 2.0 * series[j + 1, c] + series[j, c]
+
+        out[RECENT_STD, c] = np.sqrt(recent_sq / window)
+        out[PREVIOUS_STD, c] = np.sqrt(previous_sq / split)
+        out[SLOPE, c] = xy / ss_x
+        if t > 2:
+            out[ACCELERATION, c] = (diff2_sum / (t - 2 - first_diff2)) / ((recent_sum + previous_sum) / t + 1e-6)
+    return out
+
+
+@njit(cache=True)
+def _cusum_kernel(series, warmup, k, h):
+    """
+    Two-sided CUSUM change-point test over each column of a (T, K) series.
+    Each observation is standardized against the running mean and std of the
+    ones before it; alarms reset the sums.
+    Returns the step index of the last alarm per column (-1 if none).
+    """
+    t, n_columns = series.shape
+    last_alarm = np.full(n_columns, -1)
+    for c in range(n_columns):
+        mean = 0.0
+        m2 = 0.0
+        high = 0.0
+        low = 0.0
+        for i in range(t):
+            x = series[i, c]
+            if i >= warmup:
+                std = np.sqrt(m2 / i)
+                deviation = x - mean
+                if std > 0:
+                    z = deviation / std
+                elif deviation != 0:
+                    z = np.inf if deviation > 0 else -np.inf
+                else:
+                    z = 0.0
+                high = max(0.0, high + z - k)
+                low = min(0.0, low + z + k)
+                if high > h or low < -h:
+                    last_alarm[c] = i
+                    high = 0.0
+                    low = 0.0
+            # Welford update of the baseline
+            delta = x - mean
+            mean += delta / (i + 1)
+            m2 += delta * (x - mean)
+    return last_alarm
+
+
+class RunningMacroStats:
+    """
+    Running aggregates of the macro history, updated as each step is recorded,
+    so EmergenceDetector.analyze can be called every step without recomputing
+    the window statistics from scratch. Keeps per-column sums over the steps that have left the
+    recent window plus a buffer of the last window_size + 2 rows.
+    """
+    def __init__(self, window_size: int = 6):
+        self.window_size = window_size
+        self.count = 0
+        self._base: Optional[np.ndarray] = None # First row; values are stored relative to it
+        self._tail: deque = deque(maxlen=window_size + 2)
+        self._sum = np.zeros(len(MACRO_COLUMNS))
+        self._weighted_sum = np.zeros(len(MACRO_COLUMNS)) # sum of step index * value
+        self._previous_sum = np.zeros(len(MACRO_COLUMNS))
+        self._previous_sumsq = np.zeros(len(MACRO_COLUMNS))
+
+    def push(self, step_data: Dict[str, Any]):
+        """Folds one history entry into the aggregates in O(window_size)."""
+        row = np.array([step_data[k] for k in MACRO_COLUMNS], dtype=np.float64)
+        if self._base is None:
+            self._base = row
+        # Offsetting by the first row keeps flat series exactly flat
+        offset = row - self._base
+        self._sum += offset
+        self._weighted_sum += self.count * offset
+        self._tail.append(offset)
+        self.count += 1
+        if self.count > self.window_size:
+            # The row that just slid out of the recent window now counts as 'previous'
+            leaving = self._tail[-(self.window_size + 1)]
+            self._previous_sum += leaving
+            self._previous_sumsq += leaving * leaving
+
+    def summary(self) -> np.ndarray:
+        """Same (6, K) statistics as _window_stats_kernel, from the running aggregates."""
+        t, window = self.count, self.window_size
+        split = t - window
+        tail = np.array(self._tail)
+        recent = tail[-window:]
+
+        out = np.zeros((6, len(MACRO_COLUMNS)))
+        out[RECENT_MEAN] = recent.mean(axis=0) + self._base
+        out[RECENT_STD] = recent.std(axis=0)
+        previous_mean = self._previous_sum / split
+        out[PREVIOUS_MEAN] = previous_mean + self._base
+        out[PREVIOUS_STD] = np.sqrt(np.maximum(0.0, self._previous_sumsq / split - previous_mean * previous_mean))
+
+        x_mean = (t - 1) / 2.0
+        ss_x = t * (t * t - 1) / 12.0
+        out[SLOPE] = (self._weighted_sum - x_mean * self._sum) / ss_x
+
+        diff2 = np.diff(tail, n=2, axis=0)
+        if len(diff2):
+            out[ACCELERATION] = diff2[-window:].mean(axis=0) / (self._sum / t + self._base + 1e-6)
+        return out
+
 
 class EmergenceDetector:
     """
@@ -9,24 +182,44 @@ class EmergenceDetector:
     def __init__(self, window_size: int = 6):
         self.window_size = window_size
 
-    def analyze(self, history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def analyze(
+        self, history: Union[List[Dict[str, Any]], np.ndarray], running: Optional[RunningMacroStats] = None
+    ) -> Dict[str, Any]:
         """
         Analyzes time-series history for 'signature' emergence patterns.
+        `history` is a list of step dicts or a structured array with the same
+        field names (SimulationEngine.history_array).
+        Pass the engine's `running` aggregates (SimulationEngine.track_macro_stats)
+        to reuse its window statistics; they are only used when they cover exactly
+        this history and window.
         """
         if len(history) < self.window_size * 2:
             return {"unintended_consequence_index": 0, "alerts": []}
 
-        # Extract macro variables
-        prices = np.array([h["avg_price"] for h in history])
-        gini = np.array([h["gini"] for h in history])
-        compliance = np.array([h["compliance_rate"] for h in history])
-        stress = np.array([h["avg_stress"] for h in history])
+        # Extract macro variables into a (T, 4) array
+        if isinstance(history, np.ndarray):
+            series = recfunctions.structured_to_unstructured(history[list(MACRO_COLUMNS)], dtype=np.float64)
+        else:
+            series = np.fromiter(
+                (h[k] for h in history for k in MACRO_COLUMNS), dtype=np.float64, count=len(history) * len(MACRO_COLUMNS)
+            ).reshape(-1, len(MACRO_COLUMNS))
+
+        if running is not None and running.window_size == self.window_size and running.count == len(history):
+            stats = running.summary()
+        else:
+            # Windowed statistics, trend and acceleration for every column in one compiled call
+            stats = _window_stats_kernel(series, self.window_size)
+        # Change points over the finished series
+        last_change = _cusum_kernel(series, self.window_size, CUSUM_K, CUSUM_H)
+        recent_mean, previous_mean = stats[RECENT_MEAN], stats[PREVIOUS_MEAN]
+        recent_std, previous_std = stats[RECENT_STD], stats[PREVIOUS_STD]
+        slopes = stats[SLOPE]
 
         alerts = []
         scores = []
 
         # 1. Price Acceleration (Nonlinear price explosion)
-        price_accel = self.detect_acceleration(prices)
+        price_accel = float(stats[ACCELERATION, 0])
         if price_accel > 0.5:
             alerts.append({
                 "type": "Price Spiral",
@@ -36,7 +229,7 @@ class EmergenceDetector:
             scores.append(price_accel * 40)
 
         # 2. Variance Explosion (Instability)
-        price_volatility = self.detect_volatility_burst(prices)
+        price_volatility = 0.0 if previous_std[0] == 0 else float(max(0, (recent_std[0] / previous_std[0]) - 1.0))
         if price_volatility > 0.3:
             alerts.append({
                 "type": "Market Instability",
@@ -46,7 +239,7 @@ class EmergenceDetector:
             scores.append(price_volatility * 20)
 
         # 3. Compliance Collapse (Sudden shift to shadow markets)
-        compliance_drop = self.detect_sudden_drop(compliance)
+        compliance_drop = float(max(0, previous_mean[2] - recent_mean[2]))
         if compliance_drop > 0.2:
             alerts.append({
                 "type": "Compliance Collapse",
@@ -56,8 +249,8 @@ class EmergenceDetector:
             scores.append(compliance_drop * 50)
 
         # 4. Stress Decoupling (Policy improves income but stress rises)
-        stress_rise = self.detect_trend(stress)
-        if stress_rise > 0 and self.detect_trend(gini) < 0:
+        stress_rise = slopes[3]
+        if stress_rise > 0 and slopes[1] < 0:
              alerts.append({
                 "type": "Stress Decoupling",
                 "severity": "Medium",
@@ -65,6 +258,15 @@ class EmergenceDetector:
             })
              scores.append(20)
 
+        # 5. Regime Shift (CUSUM change point in the recent window); informational, not scored
+        shifted = [name for name, step in zip(MACRO_COLUMNS, last_change) if step >= len(history) - self.window_size]
+        if shifted:
+            alerts.append({
+                "type": "Regime Shift",
+                "severity": "Low",
+                "mechanism": f"A CUSUM change-point test flagged a sustained shift in {', '.join(shifted)} within the last {self.window_size} steps."
+            })
+
         uci = min(100, sum(scores))
         
         return {
@@ -77,30 +279,31 @@ class EmergenceDetector:
             }
         }
 
+    def window_stats(self, series: np.ndarray) -> np.ndarray:
+        """_window_stats_kernel for a single series: the six statistics indexed by the row constants."""
+        column = np.ascontiguousarray(series, dtype=np.float64).reshape(-1, 1)
+        return _window_stats_kernel(column, self.window_size)[:, 0]
+
     def detect_acceleration(self, series: np.ndarray) -> float:
         """Measures if the rate of change is increasing (second derivative)."""
-        diff1 = np.diff(series)
-        diff2 = np.diff(diff1)
-        if len(diff2) == 0: return 0.0
+        if len(series) <= self.window_size: return 0.0
         # Normalized acceleration
-        return float(np.mean(diff2[-(self.window_size):]) / (np.mean(series) + 1e-6))
+        return float(self.window_stats(series)[ACCELERATION])
 
     def detect_volatility_burst(self, series: np.ndarray) -> float:
         """Checks if recent variance is significantly higher than historical."""
-        recent = np.std(series[-(self.window_size):])
-        historical = np.std(series[:-(self.window_size)])
-        if historical == 0: return 0.0
-        return float(max(0, (recent / historical) - 1.0))
+        if len(series) <= self.window_size: return 0.0
+        stats = self.window_stats(series)
+        if stats[PREVIOUS_STD] == 0: return 0.0
+        return float(max(0, (stats[RECENT_STD] / stats[PREVIOUS_STD]) - 1.0))
 
     def detect_sudden_drop(self, series: np.ndarray) -> float:
         """Detects a large negative jump relative to the mean."""
-        if len(series) < 2: return 0.0
-        recent_mean = np.mean(series[-(self.window_size):])
-        prev_mean = np.mean(series[:-(self.window_size)])
-        return float(max(0, prev_mean - recent_mean))
+        if len(series) <= self.window_size: return 0.0
+        stats = self.window_stats(series)
+        return float(max(0, stats[PREVIOUS_MEAN] - stats[RECENT_MEAN]))
 
     def detect_trend(self, series: np.ndarray) -> float:
         """Returns the slope of a simple linear fit."""
-        x = np.arange(len(series))
-        slope, _ = np.polyfit(x, series, 1)
-        return float(slope)
+        if len(series) <= self.window_size: return 0.0
+        return float(self.window_stats(series)[SLOPE])
@@ -1,7 +1,28 @@
-import random
 import numpy as np
+from numba import njit
 from typing import List, Dict, Any, Optional
-from .agents import Agent
+from .agents import Agent, AgentArray
+
+@njit(cache=True)
+def _market_kernel(price, supply, demand, agent_loc, consumption):
+    """
+    Compiled Environment.update_market_dynamics over the neighborhood arrays.
+    Mutates price, supply and demand in place.
+    """
+    # Use the agents' last actual consumption rather than a static need
+    demand[:] = 0.0
+    for i in range(agent_loc.shape[0]):
+        demand[agent_loc[i]] += consumption[i]
+
+    for loc in range(price.shape[0]):
+        # Price adjustment rule (Law of Supply and Demand); supply is floored at 0.1 so the ratio is defined
+        price_pressure = demand[loc] / supply[loc]
+        # Nonlinear price response, kept within reasonable bounds (expanded ceiling to allow larger dynamics)
+        price[loc] = max(1.0, min(1000.0, price[loc] * (0.9 + 0.2 * price_pressure)))
+        # Simulate supply depletion/adjustment: supply drops a bit when demand is high
+        # Increase sensitivity so users see feedback more clearly
+        supply[loc] = max(0.1, supply[loc] - demand[loc] * 0.05)
+
 
 class Environment:
     """
@@ -10,74 +31,100 @@ class Environment:
     """
     def __init__(self, size: int = 10, connectivity: float = 0.2):
         self.size = size # E.g., a 10x10 grid of neighborhoods
+        # Neighborhood state as parallel arrays indexed by neighborhood id
         # Start with tighter supply to make dynamics more visible
-        self.neighborhoods = {i: {"supply": 50.0, "demand": 0.0, "price": 10.0} for i in range(size)}
-        self.agent_locations: Dict[int, int] = {} # agent_id -> neighborhood_id
-        
-        # Simple adjacency list for social influence
-        self.network: Dict[int, List[int]] = {} 
-
-    def place_agents(self, agents: List[Agent]):
-        """Distributes agents across neighborhoods."""
-        for agent in agents:
-            loc = random.randint(0, self.size - 1)
-            self.agent_locations[agent.id] = loc
-            
+        self.supply = np.full(size, 50.0)
+        self.demand = np.zeros(size)
+        self.price = np.full(size, 10.0)
+        self.agent_ids = np.zeros(0, dtype=np.int32)
+        self.agent_loc = np.zeros(0, dtype=np.int32) # neighborhood id, indexed like agent_ids
+
+        # Social network in CSR form: friends of agent i are neighbor_indices[neighbor_indptr[i]:neighbor_indptr[i + 1]]
+        self.neighbor_indptr = np.zeros(1, dtype=np.int32)
+        self.neighbor_indices = np.zeros(0, dtype=np.int32)
+
+        # Dict views of the arrays above, built on first read (see agent_locations / network)
+        self._agent_locations: Optional[Dict[int, int]] = None
+        self._network: Optional[Dict[int, np.ndarray]] = None
+
+    def place_agents(self, agents: List[Agent], rng: Optional[np.random.Generator] = None):
+        """Distributes agents across neighborhoods and wires up their social network."""
+        if rng is None:
+            rng = np.random.default_rng()
+        agent_ids = np.array([a.id for a in agents], dtype=np.int32)
+        n = len(agent_ids)
+
+        self.agent_ids = agent_ids
+        self.agent_loc = rng.integers(0, self.size, size=n, dtype=np.int32)
+
         # Build a basic social network (small-world or random)
-        agent_ids = [a.id for a in agents]
-        for aid in agent_ids:
-            # Each agent knows 2-5 others
-            num_friends = random.randint(2, 5)
-            self.network[aid] = random.sample(agent_ids, num_friends)
-
-    def get_neighbors_behavior(self, agent_id: int, agents_dict: Dict[int, Agent]) -> List[str]:
-        """Returns the last decision (comply/evade) of an agent's social circle."""
-        friend_ids = self.network.get(agent_id, [])
-        return [agents_dict[fid].last_decision for fid in friend_ids if fid in agents_dict]
-
-    def update_market_dynamics(self, agents: List[Agent]):
+        # Each agent knows 2-5 distinct others, drawn without replacement
+        num_friends = np.minimum(rng.integers(2, 6, size=n), n)
+        slots = np.arange(5) < num_friends[:, None]
+        picks = rng.integers(0, n, size=(n, 5)) if n else np.zeros((0, 5), dtype=np.int64)
+        while True:
+            # Redraw the rows that picked the same friend twice
+            repeated = ((picks[:, :, None] == picks[:, None, :]) & slots[:, :, None] & slots[:, None, :]).sum(axis=(1, 2)) > num_friends
+            if not repeated.any():
+                break
+            picks[repeated] = rng.integers(0, n, size=(int(repeated.sum()), 5))
+        friends = agent_ids[picks[slots]]
+
+        self.neighbor_indptr = np.zeros(len(agent_ids) + 1, dtype=np.int32)
+        np.cumsum(num_friends, out=self.neighbor_indptr[1:])
+        self.neighbor_indices = friends
+        self._agent_locations = None
+        self._network = None
+
+    @property
+    def agent_locations(self) -> Dict[int, int]:
+        """agent_id -> neighborhood_id, derived from agent_loc on first read."""
+        if self._agent_locations is None:
+            self._agent_locations = dict(zip(self.agent_ids.tolist(), self.agent_loc.tolist()))
+        return self._agent_locations
+
+    @property
+    def network(self) -> Dict[int, np.ndarray]:
+        """agent_id -> friend ids (views into neighbor_indices), derived from the CSR arrays on first read."""
+        if self._network is None:
+            friends = np.split(self.neighbor_indices, self.neighbor_indptr[1:-1])
+            self._network = dict(zip(self.agent_ids.tolist(), friends))
+        return self._network
+
+    def get_neighbors_behavior(self, agent_id: int, decisions: np.ndarray) -> np.ndarray:
+        """Returns the last decision codes (0=comply, 1=evade) of an agent's social circle."""
+        friend_ids = self.network.get(agent_id)
+        if friend_ids is None:
+            return decisions[:0]
+        return decisions[friend_ids]
+
+    @property
+    def neighborhoods(self) -> Dict[int, Dict[str, float]]:
+        """Snapshot of neighborhood state as {id: {"supply", "demand", "price"}}."""
+        return {
+            i: {"supply": supply, "demand": demand, "price": price}
+            for i, (supply, demand, price) in enumerate(zip(self.supply.tolist(), self.demand.tolist(), self.price.tolist()))
+        }
+
+    def update_market_dynamics(self, agents: AgentArray):
         """
         Updates neighborhood-level prices based on local supply and demand.
         This is where small changes can amplify into macro effects.
         """
-        # Use realized consumption (last_consumption) to compute actual demand
-        local_demands = {i: 0.0 for i in self.neighborhoods}
-        for agent in agents:
-            loc = self.agent_locations[agent.id]
-            # Use the agent's last actual consumption rather than a static need
-            local_demands[loc] += getattr(agent, "last_consumption", agent.consumption_need)
-            
-        for loc, data in self.neighborhoods.items():
-            supply = data["supply"]
-            demand = local_demands[loc]
-            
-            # Price adjustment rule (Law of Supply and Demand)
-            if supply > 0:
-                price_pressure = demand / supply
-                # Nonlinear price response
-                data["price"] = data["price"] * (0.9 + 0.2 * price_pressure)
-                # Keep price within reasonable bounds (expanded ceiling to allow larger dynamics)
-                data["price"] = max(1.0, min(1000.0, data["price"]))
-                data["demand"] = demand
-            # Simulate supply depletion/adjustment: supply drops a bit when demand is high
-            # Increase sensitivity so users see feedback more clearly
-            depletion = demand * 0.05
-            data["supply"] = max(0.1, data["supply"] - depletion)
+        _market_kernel(self.price, self.supply, self.demand, self.agent_loc, agents.last_consumption)
 
     def get_local_price(self, agent_id: int) -> float:
         loc = self.agent_locations[agent_id]
-        return self.neighborhoods[loc]["price"]
+        return float(self.price[loc])
 
     def get_local_availability(self, agent_id: int) -> float:
         # Availability should reflect local supply
         loc = self.agent_locations.get(agent_id, 0)
-        return self.neighborhoods[loc]["supply"]
+        return float(self.supply[loc])
 
     def get_macro_indicators(self) -> Dict[str, float]:
         """Aggregates state into macro variables."""
-        avg_price = np.mean([n["price"] for n in self.neighborhoods.values()])
-        total_demand = sum([n["demand"] for n in self.neighborhoods.values()])
         return {
-            "avg_price": float(avg_price),
-            "total_demand": float(total_demand)
+            "avg_price": float(self.price.mean()),
+            "total_demand": float(self.demand.sum())
         }
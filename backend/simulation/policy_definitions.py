@@ -1,7 +1,73 @@
+import numpy as np
 from dataclasses import dataclass
+from numba import vectorize
 from typing import Dict, Any, Optional
 import enum
 
+# Policy rules as compiled ufuncs: the Policy methods below apply them to scalars
+# or arrays, and the engine's compiled run loop calls them per agent/neighborhood.
+
+@vectorize(["float64(float64, float64, float64)"], cache=True)
+def subsidized_income(income, eligibility_threshold, subsidy_amount):
+    """Income after the rent subsidy, paid only below the eligibility threshold."""
+    if income < eligibility_threshold:
+        return income + subsidy_amount
+    return income
+
+@vectorize(["float64(float64, float64)"], cache=True)
+def rent_inflation_factor(market_demand, housing_supply):
+    """Price increase factor from scarcity-driven rent pressure."""
+    if housing_supply == 0:
+        return 1.0
+    pressure = market_demand / housing_supply
+    return max(0.0, (pressure - 1.0) * 0.5)
+
+@vectorize(["float64(float64, float64, float64)"], cache=True)
+def wealth_tax(asset_value, wealth_threshold, tax_rate):
+    """Tax owed on wealth above the threshold."""
+    if asset_value > wealth_threshold:
+        return (asset_value - wealth_threshold) * tax_rate
+    return 0.0
+
+@vectorize(["float64(float64, float64, float64)"], cache=True)
+def capital_flight_probability(asset_value, wealth_threshold, tax_rate):
+    """Chance that an agent moves capital out of the system."""
+    if asset_value <= wealth_threshold:
+        return 0.0
+    # RISK AGGRESSION: Make it much more sensitive to tax rates
+    # Exposure is now relative to the threshold gap
+    exposure = (asset_value - wealth_threshold) / 1000.0 # Normalized per $1000 over threshold
+    risk = exposure * tax_rate * 20.0 # Doubled sensitivity
+    return min(0.9, risk)
+
+@vectorize(["float64(float64, float64, float64)"], cache=True)
+def supply_contraction_factor(market_price, price_cap, supply_sensitivity):
+    """Share of supply that stays on the market under a price cap."""
+    if price_cap < market_price:
+        # Supply drops exponentially as gap widens
+        gap = (market_price - price_cap) / market_price
+        return max(0.1, 1.0 - (gap * supply_sensitivity))
+    return 1.0
+
+@vectorize(["float64(float64, float64)"], cache=True)
+def fuel_price(base_price, tax_rate):
+    """Price agents pay once the fuel tax is added."""
+    return base_price * (1.0 + tax_rate)
+
+@vectorize(["float64(float64, float64)"], cache=True)
+def fuel_tax_collected(fuel_spend, tax_rate):
+    """Tax share of spending at fuel_price."""
+    return fuel_spend * (tax_rate / (1.0 + tax_rate))
+
+@vectorize(["float64(float64, float64, float64)"], cache=True)
+def fuel_rebate(total_tax_collected, rebate_percent, population_size):
+    """Flat per-agent rebate from the redistributed share of the revenue."""
+    return (total_tax_collected * rebate_percent) / max(1.0, population_size)
+
+def _scalar_or_array(value):
+    """ufuncs return 0-d numpy values for scalar input; hand those back as plain floats."""
+    return value if np.ndim(value) else float(value)
+
 class PolicyType(enum.Enum):
     HOUSING_RENT_SUBSIDY = "housing_rent_subsidy"
     LUXURY_ASSET_TAX = "luxury_asset_tax"
@@ -50,20 +116,18 @@ class HousingRentSubsidy(Policy):
         super().__init__(PolicyType.HOUSING_RENT_SUBSIDY, params)
 
     def apply_intended_effect(self, agent_income: float) -> float:
-        """Increases disposable income for eligible agents."""
-        if agent_income < self.get_param("eligibility_threshold"):
-            return agent_income + self.get_param("subsidy_amount")
-        return agent_income
+        """Increases disposable income for eligible agents (scalar or per-agent array)."""
+        return _scalar_or_array(subsidized_income(
+            agent_income, self.get_param("eligibility_threshold"), self.get_param("subsidy_amount")
+        ))
 
     def apply_distortion_mechanism(self, market_demand: float, housing_supply: float) -> float:
         """
         Models rent inflation. If demand increases without supply growth, 
         prices rise, potentially offsetting the subsidy.
+        Accepts scalars or per-neighborhood arrays.
         """
-        # Simplistic scarcity-driven price pressure
-        if housing_supply == 0: return 1.0
-        pressure = (market_demand / housing_supply)
-        return max(0, (pressure - 1.0) * 0.5) # Returns a price increase factor
+        return _scalar_or_array(rent_inflation_factor(market_demand, housing_supply)) # Returns a price increase factor
 
 class LuxuryAssetTax(Policy):
     """
@@ -80,19 +144,14 @@ class LuxuryAssetTax(Policy):
         super().__init__(PolicyType.LUXURY_ASSET_TAX, params)
 
     def calculate_wealth_tax(self, asset_value: float) -> float:
-        if asset_value > self.get_param("wealth_threshold"):
-            return (asset_value - self.get_param("wealth_threshold")) * self.get_param("tax_rate")
-        return 0.0
+        """Tax owed on wealth above the threshold (scalar or per-agent array)."""
+        return _scalar_or_array(wealth_tax(asset_value, self.get_param("wealth_threshold"), self.get_param("tax_rate")))
 
     def get_capital_flight_probability(self, asset_value: float) -> float:
-        """Models the risk of agents moving capital out of the system."""
-        if asset_value <= self.get_param("wealth_threshold"): return 0.0
-        
-        # RISK AGGRESSION: Make it much more sensitive to tax rates
-        # Exposure is now relative to the threshold gap
-        exposure = (asset_value - self.get_param("wealth_threshold")) / 1000.0 # Normalized per $1000 over threshold
-        risk = exposure * self.get_param("tax_rate") * 20.0 # Doubled sensitivity
-        return min(0.9, risk)
+        """Models the risk of agents moving capital out of the system (scalar or per-agent array)."""
+        return _scalar_or_array(capital_flight_probability(
+            asset_value, self.get_param("wealth_threshold"), self.get_param("tax_rate")
+        ))
 
 class FoodPriceCeiling(Policy):
     """
@@ -109,13 +168,10 @@ class FoodPriceCeiling(Policy):
         super().__init__(PolicyType.FOOD_PRICE_CEILING, params)
 
     def supply_contraction(self, market_price: float) -> float:
-        """Models supply withdrawal when cap is below market equilibrium."""
-        cap = self.get_param("price_cap")
-        if cap < market_price:
-            # Supply drops exponentially as gap widens
-            gap = (market_price - cap) / market_price
-            return max(0.1, 1.0 - (gap * self.get_param("supply_sensitivity")))
-        return 1.0
+        """Models supply withdrawal when cap is below market equilibrium (scalar or per-neighborhood array)."""
+        return _scalar_or_array(supply_contraction_factor(
+            market_price, self.get_param("price_cap"), self.get_param("supply_sensitivity")
+        ))
 
 class FuelTaxWithRebate(Policy):
     """
@@ -132,10 +188,15 @@ class FuelTaxWithRebate(Policy):
         super().__init__(PolicyType.FUEL_TAX_REBATE, params)
 
     def apply_intended_effect(self, agent_income: float, total_tax_collected: float, population_size: int) -> float:
-        """Redistributes tax revenue as a flat rebate to all agents."""
-        rebate = (total_tax_collected * self.get_param("rebate_percent")) / max(1, population_size)
-        return agent_income + rebate
+        """Redistributes tax revenue as a flat rebate to all agents (scalar or per-agent income)."""
+        return _scalar_or_array(
+            agent_income + fuel_rebate(total_tax_collected, self.get_param("rebate_percent"), population_size)
+        )
+
+    def collect_tax(self, fuel_spend: float) -> float:
+        """Tax revenue contained in spending at the taxed price (scalar or per-agent array)."""
+        return _scalar_or_array(fuel_tax_collected(fuel_spend, self.get_param("tax_rate")))
 
     def apply_price_distortion(self, base_price: float) -> float:
-        """Increases the effective price for agents."""
-        return base_price * (1.0 + self.get_param("tax_rate"))
+        """Increases the effective price for agents (scalar or per-neighborhood array)."""
+        return _scalar_or_array(fuel_price(base_price, self.get_param("tax_rate")))
@@ -1,154 +1,336 @@
+import threading
 import numpy as np
-from typing import List, Dict, Any, Optional
-from .agents import Agent, generate_population
-from .environment import Environment
-from .policy_definitions import Policy, PolicyType
+from typing import List, Dict, Any, NamedTuple, Optional
+from numba import njit, prange
+from .agents import Agent, generate_population, _social_influence_kernel, _step_kernel
+from .emergence_detector import RunningMacroStats
+from .environment import Environment, _market_kernel
+from .policy_definitions import (
+    Policy, PolicyType, fuel_price, fuel_rebate, fuel_tax_collected, rent_inflation_factor, subsidized_income,
+    supply_contraction_factor
+)
+
+# One record per step; field names match the keys of the step dicts in `history`.
+# Stored as float32: these are reported to a few decimals, and `history` keeps full precision
+HISTORY_DTYPE = np.dtype([
+    ("step", np.int32),
+    ("avg_price", np.float32),
+    ("total_demand", np.float32),
+    ("gini", np.float32),
+    ("compliance_rate", np.float32),
+    ("avg_stress", np.float32),
+])
+
+
+class PolicyParams(NamedTuple):
+    """Scalar parameters of the active policies, as _run_core takes them; a wealth tax rate of 0 disables the luxury tax."""
+    n_policies: int
+    has_housing: bool
+    subsidy_amount: float
+    eligibility_threshold: float
+    has_fuel_tax: bool
+    fuel_tax_rate: float
+    rebate_percent: float
+    wealth_tax_rate: float
+    wealth_threshold: float
+    has_food_ceiling: bool
+    price_cap: float
+    supply_sensitivity: float
+
+
+@njit(cache=True)
+def _gini_kernel(incomes, scratch, weights):
+    """Gini coefficient of `incomes`, sorting into `scratch` with rank `weights` from SimulationEngine.gini_weights."""
+    n = incomes.shape[0]
+    scratch[:] = incomes
+    scratch.sort()
+    total = 0.0
+    weighted = 0.0
+    for i in range(n):
+        total += scratch[i]
+        weighted += weights[i] * scratch[i]
+    if total <= 0:
+        return 0.0
+    return weighted / (n * total)
+
+
+@njit(cache=True, parallel=True)
+def _run_core(
+    income, base_income, wealth, need, risk_tolerance, social_weight, compliance_probability,
+    stress, last_consumption, decisions,
+    price, supply, demand, agent_loc, neighbor_indptr, neighbor_indices,
+    params, draws, prev_compliance, agent_price, availability, gini_scratch, gini_weights, out
+):
+    """
+    Compiled body of SimulationEngine.run: advances draws.shape[0] months, mutating
+    the agent and neighborhood arrays in place. draws[t] holds step t's uniforms
+    (need noise, compliance, and capital flight when a luxury tax is active).
+    prev_compliance is the last recorded compliance rate, or negative before the first step.
+    agent_price and availability are per-agent scratch buffers, overwritten every step.
+    Writes (avg_price, total_demand, gini, compliance_rate, avg_stress) to out[t].
+    """
+    n = income.shape[0]
+    flight_row = 2 if draws.shape[1] > 2 else 1
+
+    for t in range(draws.shape[0]):
+        # 1. Apply policies and gather agent actions (agents consume based on current prices)
+
+        # Dynamic enforcement: penalty increases if many policies are active (more scrutiny)
+        # or if evasion was high in the previous step
+        base_penalty = 2.0 + (params.n_policies * 1.5)
+        if prev_compliance >= 0.0:
+            base_penalty += (1.0 - prev_compliance) * 10.0 # Increased enforcement in response to evasion
+
+        for i in prange(n):
+            # Replenish wealth for the new month
+            base_income[i] = income[i]
+            wealth[i] += income[i]
+            # Apply Policy: Intended Mechanism (e.g., Subsidies) on top of the replenished wealth
+            if params.has_housing:
+                new_income = subsidized_income(income[i], params.eligibility_threshold, params.subsidy_amount)
+                wealth[i] += new_income - income[i]
+                income[i] = new_income
+
+            # Local market conditions seen by each agent, with the Fuel Tax distortion on the price
+            agent_price[i] = price[agent_loc[i]]
+            if params.has_fuel_tax:
+                agent_price[i] = fuel_price(agent_price[i], params.fuel_tax_rate)
+            availability[i] = supply[agent_loc[i]]
+
+        # Social influence check: every agent reacts to its friends' decisions from the previous step
+        _social_influence_kernel(decisions, compliance_probability, social_weight, neighbor_indptr, neighbor_indices)
+
+        # Agent Decisions: consumption, luxury tax and compliance in one pass
+        total_tax_revenue, total_evaded, total_stress = _step_kernel(
+            wealth, need, risk_tolerance, compliance_probability, stress, last_consumption, decisions,
+            agent_price, availability, params.wealth_tax_rate, params.wealth_threshold, base_penalty,
+            draws[t, 0], draws[t, flight_row], draws[t, 1]
+        )
+
+        if params.has_fuel_tax:
+            # Collect Fuel Tax revenue (summed serially so the total doesn't depend on the thread count)
+            spend = 0.0
+            for i in range(n):
+                spend += last_consumption[i] * agent_price[i]
+            total_tax_revenue += fuel_tax_collected(spend, params.fuel_tax_rate)
+
+            # Redistribute Fuel Tax Rebates (a one-time transfer; income itself is unchanged)
+            if total_tax_revenue > 0:
+                rebate = fuel_rebate(total_tax_revenue, params.rebate_percent, n)
+                for i in prange(n):
+                    wealth[i] += rebate
+
+        # 2. Update market dynamics based on realized consumption this step
+        _market_kernel(price, supply, demand, agent_loc, last_consumption)
+
+        # Apply policy distortion mechanisms that affect price or supply, and total the
+        # final prices and demand in the same pass over the neighborhoods
+        price_sum = 0.0
+        demand_sum = 0.0
+        for loc in range(price.shape[0]):
+            # Housing: landlords may increase rents in response to demand/supply imbalance
+            if params.has_housing:
+                price[loc] = price[loc] * (1.0 + rent_inflation_factor(demand[loc], supply[loc]))
+            # Food price ceiling: suppliers may withdraw, reducing supply
+            if params.has_food_ceiling:
+                contraction = supply_contraction_factor(price[loc], params.price_cap, params.supply_sensitivity)
+                supply[loc] = max(0.1, supply[loc] * contraction)
+            price_sum += price[loc]
+            demand_sum += demand[loc]
+
+        # 3. Collect Macro Data
+        compliance_rate = 1.0 - (total_evaded / n)
+        out[t, 0] = price_sum / price.shape[0]
+        out[t, 1] = demand_sum
+        out[t, 2] = _gini_kernel(income, gini_scratch, gini_weights)
+        out[t, 3] = compliance_rate
+        out[t, 4] = total_stress / n
+        prev_compliance = compliance_rate
+
+
+# Numba's default workqueue threading layer aborts the process if a parallel kernel is
+# entered from two threads at once (e.g. concurrent API requests), so callers take turns
+_kernel_lock = threading.Lock()
+
+_warmed_up = False
+
+def warm_up_engine():
+    """
+    Compiles _run_core, and the agent and market kernels it calls (or loads them from the on-disk cache),
+    on a one-agent, one-step run, once per process, so the first real run() doesn't pay for it.
+    """
+    global _warmed_up
+    if _warmed_up:
+        return
+    one = np.ones(1)
+    params = PolicyParams(0, False, 0.0, 0.0, False, 0.0, 0.0, 0.0, 0.0, False, 0.0, 0.0)
+    with _kernel_lock:
+        if _warmed_up:
+            return
+        _run_core(
+            one.copy(), one.copy(), one.copy(), one, one, one, one.copy(), np.zeros(1), np.zeros(1),
+            np.zeros(1, dtype=np.int8), one.copy(), one.copy(), np.zeros(1), np.zeros(1, dtype=np.int32),
+            np.zeros(2, dtype=np.int32), np.zeros(0, dtype=np.int32),
+            params, np.full((1, 2, 1), 0.5), -1.0, np.empty(1), np.empty(1), np.empty(1),
+            SimulationEngine.gini_weights(1), np.empty((1, 5))
+        )
+        _warmed_up = True
+
+
+class StepPlan(NamedTuple):
+    """The active policy (or None) for each stage of SimulationEngine.step, resolved when policies change."""
+    housing: Optional[Policy] = None       # income subsidy before consumption, rent inflation after
+    fuel_tax: Optional[Policy] = None      # price distortion, revenue and rebate
+    luxury_tax: Optional[Policy] = None    # wealth tax and capital flight inside the agent pass
+    food_ceiling: Optional[Policy] = None  # supply contraction after the market update
+
 
 class SimulationEngine:
     """
     Orchestrates the time evolution of the system.
     Applies policies, updates agents, and records history.
+    The population, placement and every step draw from one Generator, in that
+    order: the per-run `rng` if given, otherwise one seeded from `seed`.
     """
-    def __init__(self, population_size: int = 100, seed: int = 42):
+    def __init__(self, population_size: int = 100, seed: int = 42, rng: Optional[np.random.Generator] = None):
+        # Compile (or load from the on-disk cache) before the first step is timed
+        warm_up_engine()
         self.seed = seed
-        self.agents = generate_population(population_size, seed=seed)
-        self.agents_dict = {a.id: a for a in self.agents}
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.agents = generate_population(population_size, seed=seed, rng=self.rng)
         self.env = Environment(size=max(1, population_size // 10))
-        self.env.place_agents(self.agents)
+        self.env.place_agents(self.agents, rng=self.rng)
+        # Agents never relocate, so the agent -> neighborhood index is fixed for the run
+        self.agent_locs = self.env.agent_loc
+        # Scratch buffers reused every step: the price and availability each agent sees,
+        # and for the Gini the sorted incomes and their rank weights
+        self._price_buf = np.empty(len(self.agents))
+        self._availability_buf = np.empty(len(self.agents))
+        self._income_buf = np.empty(len(self.agents))
+        self._gini_weights = self.gini_weights(len(self.agents))
         
-        self.active_policies: List[Policy] = []
+        # At most one policy of each type is active; adding another replaces it
+        self.policies_by_type: Dict[PolicyType, Policy] = {}
+        self._rebuild_plan()
         self.history: List[Dict[str, Any]] = []
+        # The same history as a preallocated structured array; run() reserves room up front
+        self._history_buf = np.zeros(0, dtype=HISTORY_DTYPE)
+        # Only kept once a caller asks for it via track_macro_stats()
+        self.macro_stats: Optional[RunningMacroStats] = None
         self.current_step = 0
 
+    @property
+    def active_policies(self) -> List[Policy]:
+        return list(self.policies_by_type.values())
+
     def add_policy(self, policy: Policy):
-        self.active_policies.append(policy)
+        self.policies_by_type[policy.type] = policy
+        self._rebuild_plan()
+
+    def _rebuild_plan(self):
+        self._plan = StepPlan(
+            housing=self.policies_by_type.get(PolicyType.HOUSING_RENT_SUBSIDY),
+            fuel_tax=self.policies_by_type.get(PolicyType.FUEL_TAX_REBATE),
+            luxury_tax=self.policies_by_type.get(PolicyType.LUXURY_ASSET_TAX),
+            food_ceiling=self.policies_by_type.get(PolicyType.FOOD_PRICE_CEILING),
+        )
+        # Parameters are read once here, not on every run() call
+        self._params = self._policy_params()
+
+    def _policy_params(self) -> PolicyParams:
+        """Flattens the active policies' parameters for _run_core."""
+        housing_policy, fuel_tax_policy, luxury_tax_policy, food_ceiling_policy = self._plan
+        return PolicyParams(
+            n_policies=len(self.policies_by_type),
+            has_housing=housing_policy is not None,
+            subsidy_amount=float(housing_policy.get_param("subsidy_amount")) if housing_policy else 0.0,
+            eligibility_threshold=float(housing_policy.get_param("eligibility_threshold")) if housing_policy else 0.0,
+            has_fuel_tax=fuel_tax_policy is not None,
+            fuel_tax_rate=float(fuel_tax_policy.get_param("tax_rate")) if fuel_tax_policy else 0.0,
+            rebate_percent=float(fuel_tax_policy.get_param("rebate_percent")) if fuel_tax_policy else 0.0,
+            wealth_tax_rate=float(luxury_tax_policy.get_param("tax_rate")) if luxury_tax_policy else 0.0,
+            wealth_threshold=float(luxury_tax_policy.get_param("wealth_threshold")) if luxury_tax_policy else 0.0,
+            has_food_ceiling=food_ceiling_policy is not None,
+            price_cap=float(food_ceiling_policy.get_param("price_cap")) if food_ceiling_policy else 0.0,
+            supply_sensitivity=float(food_ceiling_policy.get_param("supply_sensitivity")) if food_ceiling_policy else 0.0,
+        )
+
+    def track_macro_stats(self, window_size: int = 6) -> RunningMacroStats:
+        """
+        Keeps RunningMacroStats up to date from now on, for callers that analyze
+        after every step; steps already recorded are folded in first.
+        """
+        if self.macro_stats is None or self.macro_stats.window_size != window_size:
+            self.macro_stats = RunningMacroStats(window_size)
+            for step_data in self.history:
+                self.macro_stats.push(step_data)
+        return self.macro_stats
 
     def step(self):
         """Perform one month of simulation."""
-        self.current_step += 1
-        
-        # 1. Apply policies and gather agent actions (agents consume based on current prices)
-        total_evaded = 0
-        total_stress = 0.0
-        total_tax_revenue = 0.0
-        
-        # Dynamic enforcement: penalty increases if many policies are active (more scrutiny)
-        # or if evasion was high in the previous step
-        base_penalty = 2.0 + (len(self.active_policies) * 1.5)
-        if self.history:
-            prev_evasion = 1.0 - self.history[-1]["compliance_rate"]
-            base_penalty += prev_evasion * 10.0 # Increased enforcement in response to evasion
-        
-        # Pre-calculate policy effects that apply to all agents
-        fuel_tax_policy = next((p for p in self.active_policies if p.type == PolicyType.FUEL_TAX_REBATE), None)
-        luxury_tax_policy = next((p for p in self.active_policies if p.type == PolicyType.LUXURY_ASSET_TAX), None)
+        return self._advance(1)[0]
 
-        for agent in self.agents:
-            # Replenish wealth for the new month
-            agent.update_income(agent.income)
-            
-            # Apply Policy: Intended Mechanism (e.g., Subsidies)
-            for policy in self.active_policies:
-                if policy.type == PolicyType.HOUSING_RENT_SUBSIDY:
-                    new_income = policy.apply_intended_effect(agent.income)
-                    # This adds the subsidy to the already replenished wealth
-                    agent.wealth += (new_income - agent.income)
-                    agent.income = new_income
-            
-            # Agent Decisions: Consumption & Compliance
-            price = self.env.get_local_price(agent.id)
-            
-            # Apply Fuel Tax distortion to price
-            if fuel_tax_policy:
-                price = fuel_tax_policy.apply_price_distortion(price)
-
-            availability = self.env.get_local_availability(agent.id)
-            
-            actual_qty = agent.decide_consumption(price, availability)
-            
-            # Collect Fuel Tax revenue
-            if fuel_tax_policy:
-                tax_paid = actual_qty * price * (fuel_tax_policy.get_param("tax_rate") / (1 + fuel_tax_policy.get_param("tax_rate")))
-                total_tax_revenue += tax_paid
-
-            # Apply Luxury Tax
-            if luxury_tax_policy:
-                tax = luxury_tax_policy.calculate_wealth_tax(agent.wealth)
-                agent.wealth -= tax
-                total_tax_revenue += tax
-                
-                # Capital Flight check
-                if np.random.random() < luxury_tax_policy.get_capital_flight_probability(agent.wealth):
-                    # Agent "hides" or moves 50% of wealth out of the system
-                    agent.wealth *= 0.5
-                    agent.stress_level = min(1.0, agent.stress_level + 0.2)
-
-            # Social influence check
-            neighbors_behavior = self.env.get_neighbors_behavior(agent.id, self.agents_dict)
-            agent.apply_social_influence(neighbors_behavior)
-            
-            # Compliance check
-            bm_premium = price * 0.6 
-            decision = agent.decide_compliance(expected_penalty=base_penalty, black_market_premium=bm_premium)
-            if decision == "evade":
-                total_evaded += 1
-            
-            total_stress += agent.stress_level
-
-        # Redistribute Fuel Tax Rebates
-        if fuel_tax_policy and total_tax_revenue > 0:
-            for agent in self.agents:
-                rebate = fuel_tax_policy.apply_intended_effect(agent.income, total_tax_revenue, len(self.agents))
-                agent.wealth += (rebate - agent.income)
-                # Note: we don't update agent.income permanently here as it's a one-time rebate per step
+    def _advance(self, steps: int) -> List[Dict[str, Any]]:
+        """Runs `steps` months through the compiled loop and records them."""
+        pop, env = self.agents, self.env
 
-        # 2. Update market dynamics based on realized consumption this step
-        self.env.update_market_dynamics(self.agents)
+        # Draw all per-agent randomness up front in one Generator call: per step, need noise,
+        # compliance coin flips and, under a luxury tax, capital-flight checks
+        draws = self.rng.random((steps, 3 if self._plan.luxury_tax else 2, len(pop)))
+        prev_compliance = self.history[-1]["compliance_rate"] if self.history else -1.0
+        out = np.empty((steps, 5))
+        with _kernel_lock:
+            _run_core(
+                pop.income, pop.base_income, pop.wealth, pop.consumption_need, pop.risk_tolerance,
+                pop.social_influence_weight, pop.compliance_probability, pop.stress_level,
+                pop.last_consumption, pop.last_decision_code,
+                env.price, env.supply, env.demand, self.agent_locs, env.neighbor_indptr, env.neighbor_indices,
+                self._params, draws, prev_compliance,
+                self._price_buf, self._availability_buf, self._income_buf, self._gini_weights, out
+            )
 
-        # Apply policy distortion mechanisms that affect price or supply
-        # e.g., landlords capture subsidy (rent inflation) or price caps cause supply contraction
-        for policy in self.active_policies:
-            # Housing: landlords may increase rents in response to demand/supply imbalance
-            if policy.type == PolicyType.HOUSING_RENT_SUBSIDY:
-                for loc, data in self.env.neighborhoods.items():
-                    demand = data.get("demand", 0.0)
-                    supply = data.get("supply", 1.0)
-                    factor = policy.apply_distortion_mechanism(demand, supply)
-                    # Apply multiplicative effect
-                    data["price"] = data["price"] * (1.0 + factor)
+        records = []
+        for avg_price, total_demand, gini, compliance_rate, avg_stress in out.tolist():
+            self.current_step += 1
+            step_data = {
+                "step": self.current_step,
+                "avg_price": avg_price,
+                "total_demand": total_demand,
+                "gini": gini,
+                "compliance_rate": compliance_rate,
+                "avg_stress": avg_stress
+            }
+            self.history.append(step_data)
+            if self.macro_stats is not None:
+                self.macro_stats.push(step_data)
+            if self.current_step > len(self._history_buf):
+                self._reserve_history(max(2 * len(self._history_buf), self.current_step))
+            self._history_buf[self.current_step - 1] = tuple(step_data[name] for name in HISTORY_DTYPE.names)
+            records.append(step_data)
+        return records
 
-            # Food price ceiling: suppliers may withdraw, reducing supply
-            if policy.type == PolicyType.FOOD_PRICE_CEILING:
-                for loc, data in self.env.neighborhoods.items():
-                    contraction = policy.supply_contraction(data["price"])
-                    data["supply"] = max(0.1, data["supply"] * contraction)
+    @property
+    def history_array(self) -> np.ndarray:
+        """Recorded steps as a structured array (fields of HISTORY_DTYPE), e.g. history_array['avg_price']."""
+        return self._history_buf[:self.current_step]
 
-        # 3. Collect Macro Data
-        macro = self.env.get_macro_indicators()
-        incomes = [a.income for a in self.agents]
-        gini = self.calculate_gini(incomes)
-        
-        step_data = {
-            "step": self.current_step,
-            "avg_price": macro["avg_price"],
-            "total_demand": macro["total_demand"],
-            "gini": gini,
-            "compliance_rate": 1.0 - (total_evaded / len(self.agents)),
-            "avg_stress": total_stress / len(self.agents)
-        }
-        self.history.append(step_data)
-        return step_data
+    def _reserve_history(self, capacity: int):
+        if capacity > len(self._history_buf):
+            buf = np.zeros(capacity, dtype=HISTORY_DTYPE)
+            buf[:len(self._history_buf)] = self._history_buf
+            self._history_buf = buf
 
     def run(self, steps: int = 24):
-        results = []
-        for _ in range(steps):
-            results.append(self.step())
-        return results
+        self._reserve_history(self.current_step + steps)
+        return self._advance(steps)
+
+    @staticmethod
+    def gini_weights(n: int) -> np.ndarray:
+        """Weights 2i - n - 1 applied to the i-th smallest income (1-based) in the Gini sum."""
+        return 2.0 * np.arange(1, n + 1, dtype=np.float64) - n - 1
 
     @staticmethod
-    def calculate_gini(incomes: List[float]) -> float:
+    def calculate_gini(incomes: np.ndarray) -> float:
         """Standard Gini coefficient for inequality."""
-        incomes = sorted(incomes)
-        n = len(incomes)
-        index = np.arange(1, n + 1)
-        return (np.sum((2 * index - n  - 1) * incomes)) / (n * np.sum(incomes)) if np.sum(incomes) > 0 else 0
+        incomes = np.ascontiguousarray(incomes, dtype=np.float64)
+        return float(_gini_kernel(incomes, np.empty_like(incomes), SimulationEngine.gini_weights(len(incomes))))
@@ -1,32 +1,112 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
 from simulation.simulation_engine import SimulationEngine
 from simulation.policy_definitions import HousingRentSubsidy
-from simulation.emergence_detector import EmergenceDetector
-import json
+from simulation.emergence_detector import MACRO_COLUMNS, EmergenceDetector, _window_stats_kernel
+
+def run_one(seed: int = 42, subsidy: float = 800, threshold: float = 2000, steps: int = 24) -> Dict[str, Any]:
+    """
+    Runs one replicate. Module-level and built from plain numbers, so it can be
+    shipped to a worker process without pickling engines or policies.
+    """
+    engine = SimulationEngine(population_size=100, seed=seed)
 
-def test_simulation():
-    print("Initializing Simulation Engine...")
-    engine = SimulationEngine(population_size=100, seed=42)
-    
     # Apply a high subsidy to trigger a Price Spiral
-    policy = HousingRentSubsidy(subsidy_amount=800, eligibility_threshold=2000)
+    policy = HousingRentSubsidy(subsidy_amount=subsidy, eligibility_threshold=threshold)
     engine.add_policy(policy)
-    
+
+    engine.run(steps)
+    history = engine.history_array
+    analysis = EmergenceDetector().analyze(history)
+    return {"history": history, "analysis": analysis}
+
+def run_sweep(
+    seeds: Iterable[int], max_workers: Optional[int] = None, save_path: Optional[str] = None, **kw
+) -> List[Dict[str, Any]]:
+    """
+    Runs independent replicates across processes; results come back in seed order.
+    With `save_path`, the whole sweep is also written once via save_sweep.
+    """
+    seeds = list(seeds)
+    # Spawn rather than fork: the parent may already have started Numba's worker threads,
+    # and a forked copy of them leaves the process hanging at exit
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=spawn) as ex:
+        results = list(ex.map(partial(run_one, **kw), seeds))
+    if save_path is not None:
+        save_sweep(save_path, seeds, results)
+    return results
+
+# One row per alert raised in a sweep; `run` indexes the sweep's seeds
+ALERT_DTYPE = np.dtype([("run", np.int32), ("type", "U32"), ("severity", "U16")])
+
+def save_sweep(path: str, seeds: List[int], results: List[Dict[str, Any]]):
+    """
+    Writes a sweep to one compressed .npz: the (runs, steps) history array, the
+    UCI per run and the alerts as rows of ALERT_DTYPE. Read it back with np.load.
+    """
+    alerts = np.array(
+        [(i, alert["type"], alert["severity"]) for i, r in enumerate(results) for alert in r["analysis"]["alerts"]],
+        dtype=ALERT_DTYPE
+    )
+    np.savez_compressed(
+        path,
+        seeds=np.asarray(seeds),
+        history=np.stack([r["history"] for r in results]),
+        uci=np.array([r["analysis"]["unintended_consequence_index"] for r in results], dtype=np.float64),
+        alerts=alerts,
+    )
+
+def test_simulation():
+    print("Initializing Simulation Engine...")
     print("Running 24 steps...")
-    history = engine.run(24)
-    
-    print("Analyzing emergence...")
-    detector = EmergenceDetector()
-    analysis = detector.analyze(history)
-    
+    result = run_one(seed=42, subsidy=800, threshold=2000, steps=24)
+    history, analysis = result["history"], result["analysis"]
+
     print("\n--- Simulation Results ---")
-    print(f"Final Avg Price: {history[-1]['avg_price']:.2f}")
-    print(f"Final Gini: {history[-1]['gini']:.4f}")
-    print(f"Final Compliance: {history[-1]['compliance_rate']:.2f}")
+    print(f"Final Avg Price: {history['avg_price'][-1]:.2f}")
+    print(f"Final Gini: {history['gini'][-1]:.4f}")
+    print(f"Final Compliance: {history['compliance_rate'][-1]:.2f}")
     print(f"UCI Score: {analysis['unintended_consequence_index']}")
-    
+
     print("\n--- Detected Alerts ---")
-    for alert in analysis['alerts']:
-        print(f"[{alert['type']}] ({alert['severity']}): {alert['mechanism']}")
+    sys.stdout.write("".join(f"[{alert['type']}] ({alert['severity']}): {alert['mechanism']}\n" for alert in analysis['alerts']))
+
+def test_regime_shift_false_positive_rate():
+    # Runs with no policy have no regime to shift, so the alert should almost never fire
+    detector = EmergenceDetector()
+    fired = 0
+    seeds = range(100)
+    for seed in seeds:
+        engine = SimulationEngine(population_size=100, seed=seed)
+        engine.run(24)
+        analysis = detector.analyze(engine.history_array)
+        fired += any(alert["type"] == "Regime Shift" for alert in analysis["alerts"])
+    assert fired / len(seeds) <= 0.05
+
+def test_running_stats_match_window_kernel():
+    # The per-step aggregates must reproduce the batch statistics analyze computes from the full history
+    engine = SimulationEngine(population_size=100, seed=7)
+    engine.add_policy(HousingRentSubsidy(subsidy_amount=800, eligibility_threshold=2000))
+    engine.run(5)
+    running = engine.track_macro_stats()
+    detector = EmergenceDetector()
+    for _ in range(19):
+        engine.step()
+        if len(engine.history) < 2 * detector.window_size:
+            continue
+        series = np.array([[h[k] for k in MACRO_COLUMNS] for h in engine.history])
+        np.testing.assert_allclose(
+            running.summary(), _window_stats_kernel(series, detector.window_size), rtol=1e-9, atol=1e-9
+        )
+        assert detector.analyze(engine.history, running) == detector.analyze(engine.history)
 
 if __name__ == "__main__":
     test_simulation()